@@ -2,11 +2,37 @@ import dash
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
+import dash_table
+import collections
+import flask
+import functools
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+import numpy as np
 import pandas as pd
 import requests
-import plotly.graph_objects as go
 
-from dash.dependencies import Input, Output
+from concurrent.futures import Future, ThreadPoolExecutor
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from urllib.parse import urlparse
+
+try:
+    import pyarrow as pa # Optional: only needed for Arrow exports in the API
+except ImportError:
+    pa = None
+
+try:
+    import brotli # Optional: responses are served gzip-only without it
+except ImportError:
+    brotli = None
 
 ### Launch app
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -16,251 +42,418 @@ app.config.suppress_callback_exceptions = True # suppress callback errors
 server = app.server
 app.title="COVID-19 Live Dashboard"
 
+### Upstream Calls
+# Every outbound call runs with a hard time budget behind a circuit breaker per host. If a call fails, times out or
+# the circuit is open, the last good value is returned together with the time it was fetched ("stale as of").
+# Base URLs can be overridden, e.g. to point the app at the stand-in servers of loadtest.py
+jhu_url = os.environ.get("JHU_URL", "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/")
+novelcovid_url = os.environ.get("NOVELCOVID_URL", "https://corona.lmao.ninja/")
+upstream_budget = 3 # Seconds a live API call may take on the request path
+download_budget = 30 # Seconds a JHU CSV download may take
+breaker_threshold = 3 # Consecutive failures that open the circuit
+breaker_cooldown = 30 # Seconds until an open circuit lets a trial call through
+upstream_pool = ThreadPoolExecutor(max_workers=8)
+
+class UpstreamUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.cooldown:
+                self.opened_at = time.time() # Half-open: one trial call, the others keep failing fast
+                return True
+            return False
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.time()
+
+breakers = {}
+last_good = {} # url -> (value, time fetched)
+
+def parse_json(response):
+    response.raise_for_status()
+    return response.json()
+
+def parse_csv(response):
+    response.raise_for_status()
+    return pd.read_csv(io.StringIO(response.text))
+
+def fetch_upstream(url, parse=parse_json, budget=upstream_budget):
+    breaker = breakers.setdefault(urlparse(url).netloc, CircuitBreaker(breaker_threshold, breaker_cooldown))
+    if breaker.allow():
+        future = upstream_pool.submit(lambda: parse(requests.get(url, timeout=budget)))
+        try:
+            value = future.result(timeout=budget)
+        except requests.HTTPError as error:
+            if error.response is not None and error.response.status_code < 500: # e.g. unknown country: upstream is healthy
+                breaker.record(True)
+                raise UpstreamUnavailable(url)
+            breaker.record(False)
+        except Exception:
+            breaker.record(False)
+        else:
+            breaker.record(True)
+            last_good[url] = (value, time.time())
+            return value, None
+    if url in last_good:
+        return last_good[url]
+    raise UpstreamUnavailable(url)
+
+# Card content for a live count, with a hint if the value is a fallback
+def kpi_card_body(value, stale_since=None):
+    children = [html.H3(f'{int(value) :,}' if value is not None and value == value else "n/a", className="card-title")]
+    if stale_since is not None:
+        children.append(html.Small("stale as of " + time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(stale_since)), className="text-muted"))
+    return children
+
 ### Import Data from JHU CSSE & create new country dataframe
-# Import Data
-df_cases_jhu = pd.read_csv("https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv")
-df_recovered_jhu = pd.read_csv("https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv")
-df_deaths_jhu = pd.read_csv("https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv")
+jhu_sources = {
+    "cases": "csse_covid_19_time_series/time_series_covid19_confirmed_global.csv",
+    "recovered": "csse_covid_19_time_series/time_series_covid19_recovered_global.csv",
+    "deaths": "csse_covid_19_time_series/time_series_covid19_deaths_global.csv",
+}
 
 # Country Dataframe: Create new dataframes with entries per country (sum over province) & rename columns to single words & drop Lat and Long columns
-df_cases = df_cases_jhu.rename(columns={"Country/Region": "Country", "Province/State": "Province"}).groupby("Country").sum().reset_index().drop(["Lat", "Long"], axis=1)
-df_recovered = df_recovered_jhu.rename(columns={"Country/Region": "Country", "Province/State": "Province"}).groupby("Country").sum().reset_index().drop(["Lat", "Long"], axis=1)
-df_deaths = df_deaths_jhu.rename(columns={"Country/Region": "Country", "Province/State": "Province"}).groupby("Country").sum().reset_index().drop(["Lat", "Long"], axis=1)
+def to_country_frame(df_jhu):
+    # Drop the non-date columns explicitly, an all-empty Province column is read as float and would survive the sum
+    return df_jhu.rename(columns={"Country/Region": "Country", "Province/State": "Province"}).drop(["Province", "Lat", "Long"], axis=1).groupby("Country").sum().reset_index()
 
+# ISO codes & population per country: country-level rows of the lookup table have no province/county
+def to_country_lookup(df_lookup_jhu):
+    return df_lookup_jhu[df_lookup_jhu["Province_State"].isna() & df_lookup_jhu["Admin2"].isna()].groupby("Country_Region").agg({"iso2": "first", "iso3": "first", "Population": "first"})
 
-### Call APIs for live counts world
-live_all = requests.get("https://corona.lmao.ninja/all").json()
+def fetch_csv(path, prepare):
+    df_jhu, _ = fetch_upstream(jhu_url + path, parse_csv, download_budget)
+    return prepare(df_jhu)
 
-### Create Country Selection Lists
-countries_top10 = ["US", "Italy", "Spain", "China", "Germany", "France", "Iran", "United Kingdom", "Switzerland", "Turkey"]
-countries_top15 = ["US", "Italy", "Spain", "China", "Germany", "France", "Iran", "United Kingdom", "Switzerland", "Turkey", "Belgium", "Netherlands", "Austria", "Korea, South", "Canada"]
-countries_top20 = ["US", "Italy", "Spain", "China", "Germany", "France", "Iran", "United Kingdom", "Switzerland", "Turkey", "Belgium", "Netherlands", "Austria", "Korea, South", "Canada", "Portugal", "Brazil", "Israel", "Norway", "Australia"]
-countries_asia = ["China", "Korea, South", "Georgia", "Malaysia", "Philippines", "Japan", "Pakistan", "India", "Thailand", "Indonesia"]
-countries_europe = ["Italy", "Spain", "Germany", "France",
-"United Kingdom", "Switzerland", "Belgium", "Netherlands", "Austria", "Portugal"]
-# Country selection depending on Measures:
-countries_mask = ["China", "Korea, South", "Japan", "Singapore", "Taiwan*", "Czechia"]
-countries_nomask = ["US", "Italy", "Spain", "Germany", "France", "United Kingdom"]
-threshold = 100 # Minimum number of cases on first day for trend plots
+### Call APIs for live counts world & per country
+def fetch_live(path, default):
+    try:
+        return fetch_upstream(novelcovid_url + path)
+    except UpstreamUnavailable:
+        return default, None
 
-### Create Dropdown options
-dropdown_options = [{"label" : i, "value" : i} for i in df_cases["Country"].unique()]
+# Data version: changes whenever the loaded data changes, used for ETags and the response cache. The JHU version only
+# covers the time series; the data version adds the live values as (value, stale since) pairs, so falling back to or
+# recovering from a stale value also changes it.
+def compute_data_version(*frames, live=None):
+    digest = hashlib.sha1()
+    for df in frames:
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    digest.update(json.dumps(live, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
 
-### Create Map figure
+### Country Rankings
+# Metrics computed per country (column id, column title). Rankings are recomputed whenever the data is loaded.
+ranking_metrics = [
+    ("cases", "Total Cases"),
+    ("new_cases", "New Cases"),
+    ("cases_per_million", "Cases per 1M"),
+    ("growth", "Weekly Growth (%)"),
+    ("deaths", "Total Deceased"),
+    ("new_deaths", "New Deceased"),
+    ("deaths_per_million", "Deceased per 1M"),
+    ("recovered", "Total Recovered"),
+]
 
-#World Map
-fig_world = go.Figure()
-scale = df_cases["4/5/20"].max() # Use max cases in country on "4/5/20" as scaling factor
-fig_world.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_cases['Country'],
-        text = df_cases.iloc[:,-1],
-        marker = dict(
-            size = df_cases.iloc[:,-1]*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'red',
-            opacity = 0.7,
-            ),
-        name='total confirmed'
-        )
-    )
+def compute_rankings(df_cases, df_recovered, df_deaths, population):
+    cases = df_cases.set_index("Country").iloc[:, -8:] # Last 8 days are enough for totals, daily and weekly changes
+    deaths = df_deaths.set_index("Country").iloc[:, -2:].reindex(cases.index)
+    recovered = df_recovered.set_index("Country").iloc[:, -1].reindex(cases.index)
+    population = population.reindex(cases.index)
+    week_ago = cases.iloc[:, 0].where(cases.iloc[:, 0] > 0) # No growth rate for countries without cases a week ago
+    df_rankings = pd.DataFrame({
+        "cases": cases.iloc[:, -1],
+        "new_cases": cases.iloc[:, -1] - cases.iloc[:, -2],
+        "cases_per_million": (cases.iloc[:, -1] / population * 1e6).round(1),
+        "growth": ((cases.iloc[:, -1] / week_ago - 1) * 100).round(1),
+        "deaths": deaths.iloc[:, -1],
+        "new_deaths": deaths.iloc[:, -1] - deaths.iloc[:, -2],
+        "deaths_per_million": (deaths.iloc[:, -1] / population * 1e6).round(1),
+        "recovered": recovered,
+    })
+    df_rankings.index.name = "Country"
+    return df_rankings
 
-df_recovered_size = df_recovered.iloc[:,-1] + df_deaths.iloc[:,-1] # Add Deaths to recovered size since deaths are displayed on top. This way at the end total confirmed size = total recovered size
-fig_world.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_recovered['Country'],
-        text = df_recovered.iloc[:,-1],
-        marker = dict(
-            size = df_recovered_size*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'green',
-            opacity = 0.7,
-            ),
-        name='total recovered'
-        )
-    )
+# Partial sort: only the first n entries are ordered, NaN values are ranked last
+def rank_countries(rankings, metric, n, ascending=False, among=None):
+    ranking = rankings[metric] if among is None else rankings[metric][rankings.index.isin(among)]
+    top = ranking.nsmallest(n) if ascending else ranking.nlargest(n)
+    if len(top) < n:
+        top = pd.concat([top, ranking[ranking.isna()]])[:n]
+    return top.index.tolist()
 
-fig_world.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_deaths['Country'],
-        text = df_deaths.iloc[:,-1],
-        marker = dict(
-            size = df_deaths.iloc[:,-1]*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'yellow',
-            opacity = 0.7,
-            ),
-        name='total deceased'
-        )
-    )
+### Data Store
+# Series per metric as arrays of shape (countries, days) with the days sorted, plus the matching date index.
+# A date range is turned into a slice by two binary searches, and slicing the arrays returns views.
+def build_store(df_cases, df_recovered, df_deaths, lookup):
+    labels = df_cases.columns[1:]
+    dates = pd.to_datetime(labels, format="%m/%d/%y")
+    order = dates.argsort()
+    countries = df_cases["Country"].tolist()
+    store = {
+        "dates": dates[order],
+        "labels": dates[order].strftime("%Y-%m-%d").to_numpy(),
+        "countries": countries,
+    }
+    for metric, df in (("cases", df_cases), ("recovered", df_recovered), ("deaths", df_deaths)):
+        values = df.set_index("Country").reindex(index=countries, columns=labels).to_numpy(dtype=float)[:, order]
+        store[metric] = values
+        store["new_" + metric] = np.diff(values, axis=1, prepend=np.nan)
+        store["world_" + metric] = np.nansum(values, axis=0)
+        store["world_new_" + metric] = np.diff(store["world_" + metric], prepend=np.nan)
+    store.update(build_registry(countries, lookup))
+    # Map marker sizes for every day at once, scaled by the largest count in the whole history. Deaths are added to
+    # the recovered size since deaths are displayed on top. This way at the end total confirmed size = total recovered size
+    values = np.nan_to_num(np.stack([store["cases"], store["recovered"] + store["deaths"], store["deaths"]]))
+    store["map_sizes"] = (values * (1000 / max(values.max(), 1))).round(1)
+    store["map_values"] = np.nan_to_num(np.stack([store["cases"], store["recovered"], store["deaths"]])).astype(np.int64) # Hover texts
+    return store
 
-fig_world.update_layout(
-        title = 'World',
-        showlegend = True,
-        legend_orientation="h",
-        legend=dict(x=0.25, y=0),
-        height = 400,
-        margin = {"r":0,"t":50,"l":0,"b":0},
-        geo = dict(
-            scope = 'world',
-            landcolor = 'rgb(217, 217, 217)',
-            showcountries = True,
-            countrycolor = "white",
-            coastlinecolor = "white",
-            showframe = True,
-            #lonaxis_range= [ -150, None ],
-            #lataxis_range= [ -60, 90 ],
-            projection_type = 'natural earth'
-        )
-    )
+def date_window(dates, start=None, end=None):
+    first = 0 if start is None else dates.searchsorted(pd.Timestamp(start), side="left")
+    last = len(dates) if end is None else dates.searchsorted(pd.Timestamp(end), side="right")
+    return slice(first, last)
 
-# Europe Map
-fig_europe = go.Figure()
-
-fig_europe.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_cases['Country'],
-        text = df_cases.iloc[:,-1],
-        marker = dict(
-            size = df_cases.iloc[:,-1]*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'red',
-            opacity = 0.7,
-            ),
-        name='total confirmed'
-        )
+# Slider values are day ordinals, so the marks stay meaningful when new days are added
+def date_range_slider(id, data):
+    dates = data["dates"]
+    first, last = dates[0].toordinal(), dates[-1].toordinal()
+    return dcc.RangeSlider(
+        id=id,
+        min=first,
+        max=last,
+        step=1,
+        value=[first, last],
+        allowCross=False,
+        marks={date.toordinal(): date.strftime("%b %d") for date in dates if date.day == 1},
     )
 
-fig_europe.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_recovered['Country'],
-        text = df_recovered.iloc[:,-1],
-        marker = dict(
-            size = df_recovered_size*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'green',
-            opacity = 0.7,
-            ),
-        name='total recovered'
-        )
-    )
+def slider_window(dates, date_range):
+    if not date_range:
+        return slice(None)
+    return date_window(dates, pd.Timestamp.fromordinal(date_range[0]), pd.Timestamp.fromordinal(date_range[1]))
 
-fig_europe.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_deaths['Country'],
-        text = df_deaths.iloc[:,-1],
-        marker = dict(
-            size = df_deaths.iloc[:,-1]*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'yellow',
-            opacity = 0.7,
-            ),
-        name='total deceased'
-        )
-    )
+### Country Registry
+# Every country gets a small integer id (its row in the store). JHU names, ISO codes and the names used by the
+# NovelCOVID API all map to that id, so live counts and historical series are joined once at ingest.
+live_fields = ["cases", "active", "recovered", "deaths"]
+# NovelCOVID names that can not be matched by ISO code -> JHU name
+country_aliases = {
+    "USA": "US",
+    "UK": "United Kingdom",
+    "S. Korea": "Korea, South",
+    "Taiwan": "Taiwan*",
+    "Czech Republic": "Czechia",
+    "Myanmar": "Burma",
+    "Palestine": "West Bank and Gaza",
+    "Ivory Coast": "Cote d'Ivoire",
+    "Vatican City": "Holy See",
+}
 
-fig_europe.update_layout(
-        title = 'Europe',
-        showlegend = True,
-        legend_orientation="h",
-        legend=dict(x=0.25, y=0),
-        height = 400,
-        margin = {"r":0,"t":50,"l":0,"b":0},
-        geo = dict(
-            scope = 'europe',
-            landcolor = 'rgb(217, 217, 217)',
-            showcountries = True,
-            countrycolor = "white",
-            coastlinecolor = "white",
-            showframe = True,
-            #lonaxis_range= [ -150, None ],
-            #lataxis_range= [ -60, 90 ],
-            projection_type = 'natural earth'
-        )
-    )
+def alias_key(name):
+    return " ".join(str(name).replace("*", "").casefold().split())
 
-# Asia Map
-fig_asia = go.Figure()
-
-fig_asia.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_cases['Country'],
-        text = df_cases.iloc[:,-1],
-        marker = dict(
-            size = df_cases.iloc[:,-1]*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'red',
-            opacity = 0.7,
-            ),
-        name='total confirmed'
-        )
-    )
+# Most comma-separated pieces a single name spans ("Korea, South" spans two), bounds the look-ahead of split_countries
+def alias_pieces(aliases):
+    return max((alias.count(",") for alias in aliases), default=0) + 1
 
-fig_asia.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_recovered['Country'],
-        text = df_recovered.iloc[:,-1],
-        marker = dict(
-            size = df_recovered_size*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'green',
-            opacity = 0.7,
-            ),
-        name='total recovered'
-        )
-    )
+def build_registry(countries, lookup):
+    lookup = lookup.reindex(countries)
+    aliases = {}
+    for cid, names in enumerate(zip(countries, lookup["iso2"], lookup["iso3"])):
+        for name in names:
+            if isinstance(name, str) and name:
+                aliases.setdefault(alias_key(name), cid)
+    for alias, country in country_aliases.items():
+        if alias_key(country) in aliases:
+            aliases.setdefault(alias_key(alias), aliases[alias_key(country)])
+    return {
+        "aliases": aliases,
+        "alias_pieces": alias_pieces(aliases),
+        "iso2": lookup["iso2"].to_numpy(),
+        "iso3": lookup["iso3"].to_numpy(),
+        "population": lookup["Population"].to_numpy(dtype=float),
+    }
 
-fig_asia.add_trace(go.Scattergeo(
-        locationmode = 'country names',
-        locations = df_deaths['Country'],
-        text = df_deaths.iloc[:,-1],
-        marker = dict(
-            size = df_deaths.iloc[:,-1]*1000/scale,
-            line_color='rgb(40,40,40)',
-            line_width=0.5,
-            sizemode = 'area',
-            color = 'yellow',
-            opacity = 0.7,
-            ),
-        name='total deceased'
-        )
-    )
+def resolve_country(name, data):
+    return data["aliases"].get(alias_key(name)) if name is not None else None
+
+# Live counts per country id from the NovelCOVID /countries response, NaN where a country has no live data
+def merge_live(data, live_countries, live_stale):
+    aliases = dict(data["aliases"])
+    live = {"live_" + field: np.full(len(data["countries"]), np.nan) for field in live_fields}
+    for entry in live_countries:
+        info = entry.get("countryInfo") or {}
+        name = entry.get("country")
+        if not name: # Malformed entry, skip it instead of failing the whole refresh
+            continue
+        cid = next((aliases[alias_key(alias)] for alias in (info.get("iso3"), info.get("iso2"), name) if alias and alias_key(alias) in aliases), None)
+        if cid is None:
+            continue
+        aliases.setdefault(alias_key(name), cid)
+        for field in live_fields:
+            if entry.get(field) is not None:
+                live["live_" + field][cid] = entry[field]
+    live["aliases"] = aliases
+    live["alias_pieces"] = alias_pieces(aliases)
+    live["live_stale"] = live_stale
+    return live
+
+# Splits a comma-separated list of countries, keeping names that contain commas ("US,Korea, South") together by
+# preferring the longest run of pieces that resolves. Runs are never longer than the longest known name, so splitting
+# stays linear in the number of pieces. Pieces that do not resolve are returned as they are.
+def split_countries(value, data):
+    pieces, countries, start = value.split(","), [], 0
+    while start < len(pieces):
+        end = next((end for end in range(min(len(pieces), start + data["alias_pieces"]), start, -1) if resolve_country(",".join(pieces[start:end]), data) is not None), start + 1)
+        name = ",".join(pieces[start:end]).strip()
+        if name:
+            countries.append(name)
+        start = end
+    return countries
+
+def live_kpi(country, field, data):
+    cid = resolve_country(country, data)
+    return kpi_card_body(data["live_" + field][cid] if cid is not None else None, data["live_stale"])
+
+### Load Data
+# All sources are downloaded and aggregated concurrently on a bounded pool, so loading takes about as long as the
+# slowest source. The same pool is used by the scheduled refreshes. Both refreshes run under one lock and publish
+# everything the app shows as a new store with a single assignment; a store is never changed once published, so a
+# request reading `store` once sees consistent data.
+loader_pool = ThreadPoolExecutor(max_workers=5)
+refresh_interval = 60 * 60 # Seconds between scheduled data refreshes
+live_refresh_interval = 10 * 60 # Seconds between scheduled refreshes of the live counts only
+refresh_lock = threading.Lock()
+
+def load_data():
+    global store
+    with refresh_lock:
+        futures = {name: loader_pool.submit(fetch_csv, path, to_country_frame) for name, path in jhu_sources.items()}
+        futures["lookup"] = loader_pool.submit(fetch_csv, "UID_ISO_FIPS_LookUp_Table.csv", to_country_lookup)
+        futures["live_all"] = loader_pool.submit(fetch_live, "all", {})
+        futures["live_countries"] = loader_pool.submit(fetch_live, "countries", [])
+        data = {name: future.result() for name, future in futures.items()}
+
+        new_store = build_store(data["cases"], data["recovered"], data["deaths"], data["lookup"])
+        new_store.update(merge_live(new_store, *data["live_countries"]))
+        new_store["df_cases"] = data["cases"]
+        new_store["rankings"] = compute_rankings(data["cases"], data["recovered"], data["deaths"], data["lookup"]["Population"])
+        new_store["dropdown_options"] = [{"label" : i, "value" : i} for i in data["cases"]["Country"].unique()]
+        new_store["live_all"], new_store["live_all_stale"] = data["live_all"]
+        new_store["jhu_version"] = compute_data_version(data["cases"], data["recovered"], data["deaths"])
+        new_store["version"] = compute_data_version(live=[new_store["jhu_version"], data["live_all"], data["live_countries"]])
+        store = new_store
+
+def load_live():
+    global store
+    with refresh_lock:
+        live_all_future = loader_pool.submit(fetch_live, "all", {})
+        live_countries_future = loader_pool.submit(fetch_live, "countries", [])
+        live_all, live_countries = live_all_future.result(), live_countries_future.result()
+        new_store = dict(store, **merge_live(store, *live_countries))
+        new_store["live_all"], new_store["live_all_stale"] = live_all
+        new_store["version"] = compute_data_version(live=[store["jhu_version"], live_all, live_countries])
+        store = new_store
+
+def schedule_refresh(job, interval):
+    def refresh():
+        try:
+            job()
+        except Exception:
+            server.logger.exception("Data refresh failed, keeping the previous data")
+        schedule_refresh(job, interval)
+    timer = threading.Timer(interval, refresh)
+    timer.daemon = True
+    timer.start()
+
+load_data()
+schedule_refresh(load_data, refresh_interval)
+schedule_refresh(load_live, live_refresh_interval)
+
+### Create Country Selection Lists
+# Region membership only, the countries shown per region are ranked from the data
+region_europe = ["Albania", "Andorra", "Austria", "Belarus", "Belgium", "Bosnia and Herzegovina", "Bulgaria", "Croatia", "Cyprus", "Czechia", "Denmark", "Estonia", "Finland", "France", "Germany", "Greece", "Holy See", "Hungary", "Iceland", "Ireland", "Italy", "Kosovo", "Latvia", "Liechtenstein", "Lithuania", "Luxembourg", "Malta", "Moldova", "Monaco", "Montenegro", "Netherlands", "North Macedonia", "Norway", "Poland", "Portugal", "Romania", "Russia", "San Marino", "Serbia", "Slovakia", "Slovenia", "Spain", "Sweden", "Switzerland", "Ukraine", "United Kingdom"]
+region_asia = ["Afghanistan", "Armenia", "Azerbaijan", "Bahrain", "Bangladesh", "Bhutan", "Brunei", "Burma", "Cambodia", "China", "Georgia", "India", "Indonesia", "Iran", "Iraq", "Israel", "Japan", "Jordan", "Kazakhstan", "Korea, South", "Kuwait", "Kyrgyzstan", "Laos", "Lebanon", "Malaysia", "Maldives", "Mongolia", "Nepal", "Oman", "Pakistan", "Philippines", "Qatar", "Saudi Arabia", "Singapore", "Sri Lanka", "Syria", "Taiwan*", "Thailand", "Timor-Leste", "Turkey", "United Arab Emirates", "Uzbekistan", "Vietnam", "West Bank and Gaza"]
+# Country selection depending on Measures:
+countries_mask = ["China", "Korea, South", "Japan", "Singapore", "Taiwan*", "Czechia"]
+countries_nomask = ["US", "Italy", "Spain", "Germany", "France", "United Kingdom"]
+threshold = 100 # Minimum number of cases on first day for trend plots
 
-fig_asia.update_layout(
-        title = 'Asia',
-        showlegend = True,
-        legend_orientation="h",
-        legend=dict(x=0.25, y=0),
-        height = 400,
-        margin = {"r":0,"t":50,"l":0,"b":0},
-        geo = dict(
-            scope = 'asia',
-            landcolor = 'rgb(217, 217, 217)',
-            showcountries = True,
-            countrycolor = "white",
-            coastlinecolor = "white",
-            showframe = True,
-            #lonaxis_range= [ -150, None ],
-            #lataxis_range= [ -60, 90 ],
-            projection_type = 'natural earth'
+### Create Map figure
+# Timeline maps: the static parts of the figures are sent once with the tab, marker sizes and texts follow in chunks of
+# days. The browser draws the selected day from the loaded chunk (assets/maps.js) and only asks the server for the
+# next chunk once the slider, or the Play button stepping it, leaves the loaded one.
+map_chunk_days = 14
+map_frame_ms = 700 # Time per day while playing
+map_traces = [("total confirmed", "red"), ("total recovered", "green"), ("total deceased", "yellow")]
+map_scopes = [("World", "world"), ("Europe", "europe"), ("Asia", "asia")]
+
+def map_base_figure(scope):
+    return {
+        'data': [
+            dict(
+                type='scattergeo',
+                locationmode='ISO-3',
+                marker=dict(
+                    line=dict(color='rgb(40,40,40)', width=0.5),
+                    sizemode='area',
+                    color=color,
+                    opacity=0.7,
+                ),
+                name=name
+            ) for name, color in map_traces
+        ],
+        'layout': dict(
+            showlegend=True,
+            legend=dict(orientation="h", x=0.25, y=0),
+            height=400,
+            margin={"r":0,"t":50,"l":0,"b":0},
+            geo=dict(
+                scope=scope,
+                landcolor='rgb(217, 217, 217)',
+                showcountries=True,
+                countrycolor="white",
+                coastlinecolor="white",
+                showframe=True,
+                projection_type='natural earth'
+            )
         )
-    )
+    }
+
+# First day of the chunk that contains day, chunks at the end of the history end on the last day
+def map_chunk_start(day, data):
+    return max(0, min(day, len(data["labels"]) - map_chunk_days))
+
+# Sizes and texts as [trace][day][country] lists for the days start .. start + map_chunk_days. The locations travel
+# with every chunk, so chunks loaded after a data refresh still line up.
+def map_chunk(start, data):
+    days = slice(start, start + map_chunk_days)
+    return {
+        "start": start,
+        "locations": [iso3 if isinstance(iso3, str) else None for iso3 in data["iso3"]],
+        "labels": data["labels"][days].tolist(),
+        "sizes": data["map_sizes"][:, :, days].transpose(0, 2, 1).tolist(),
+        "text": data["map_values"][:, :, days].transpose(0, 2, 1).tolist(),
+    }
 
 
 ### App Layout
@@ -314,32 +507,286 @@ app.layout = html.Div([
     html.Div(id='tabs-content-classes')
 ], className='ten columns offset-by-one')
 
+### Request Coalescing
+# Identical callback computations that are in flight at the same time (e.g. many users opening the same tab) run
+# only once and share the result. Requests of a browser session for the same output (fast tab switching, scrolling
+# through the dropdown) run one after another. A waiting request is woken up as soon as a newer one arrives and is
+# then answered with "no update" right away, so superseded requests do not hold a thread while the slot is busy.
+# Both only apply within one gunicorn worker process, so workers need several threads.
+latest_requests = collections.OrderedDict() # (session, output) -> number of the latest request
+latest_requests_size = 10000
+latest_requests_lock = threading.Lock()
+slots = {} # (session, output) -> {"condition", "busy", "users": number of requests running or waiting}
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+@server.before_request
+def track_latest_request():
+    if not flask.request.path.endswith("/_dash-update-component"):
+        return None
+    session = flask.request.cookies.get("session_id")
+    body = flask.request.get_json(silent=True) or {}
+    if session is None or "output" not in body:
+        return None
+    slot = (session, body["output"])
+    with latest_requests_lock:
+        generation = latest_requests.get(slot, 0) + 1
+        latest_requests[slot] = generation
+        latest_requests.move_to_end(slot)
+        while len(latest_requests) > latest_requests_size:
+            latest_requests.popitem(last=False)
+        if slot in slots:
+            slots[slot]["condition"].notify_all() # Lets superseded waiters give up their threads
+    flask.g.request_slot, flask.g.request_generation = slot, generation
+    return None
+
+@server.after_request
+def set_session_cookie(response):
+    if "session_id" not in flask.request.cookies:
+        response.set_cookie("session_id", uuid.uuid4().hex, httponly=True, samesite="Lax")
+    return response
+
+def superseded():
+    slot = flask.g.get("request_slot")
+    return slot is not None and latest_requests.get(slot, flask.g.request_generation) != flask.g.request_generation
+
+# Waits until no other request of the (session, output) slot runs. Raises PreventUpdate once the request is
+# superseded, before waiting as well as after every wake-up.
+def acquire_slot():
+    slot = flask.g.get("request_slot")
+    if slot is None:
+        return None
+    with latest_requests_lock:
+        entry = slots.setdefault(slot, {"condition": threading.Condition(latest_requests_lock), "busy": False, "users": 0})
+        entry["users"] += 1
+        while not superseded() and entry["busy"]:
+            entry["condition"].wait()
+        if superseded():
+            leave_slot(slot, entry)
+            raise PreventUpdate
+        entry["busy"] = True
+    return entry
+
+def release_slot(entry):
+    if entry is None:
+        return
+    with latest_requests_lock:
+        entry["busy"] = False
+        leave_slot(flask.g.request_slot, entry)
+        entry["condition"].notify_all()
+
+# Called with latest_requests_lock held, the slot entry is dropped once no request runs or waits
+def leave_slot(slot, entry):
+    entry["users"] -= 1
+    if not entry["users"]:
+        del slots[slot]
+
+# Identical computations in flight share one result
+def run_coalesced(function, args):
+    key = (flask.request.get_json()["output"], json.dumps(args, sort_keys=True, default=str))
+    with in_flight_lock:
+        call = in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = in_flight[key] = Future()
+    if not leader:
+        return call.result()
+    try:
+        result = function(*args)
+    except BaseException as error:
+        call.set_exception(error)
+        raise
+    else:
+        call.set_result(result)
+        return result
+    finally:
+        with in_flight_lock:
+            del in_flight[key]
+
+def coalesce(function):
+    @functools.wraps(function)
+    def wrapper(*args):
+        slot = acquire_slot()
+        try:
+            return run_coalesced(function, args)
+        finally:
+            release_slot(slot)
+    return wrapper
+
 ### Callbacks
 # Callback Dropdown - KPIs
 @app.callback(Output('card-cases', 'children'),
              [Input('my-dropdown', 'value')])
+@coalesce
 def update_children(X):
-    return html.H3(str(f'{requests.get("https://corona.lmao.ninja/countries/"+str(X)).json()["cases"] :,}'), className="card-title")
+    return live_kpi(X, "cases", store)
 
 @app.callback(Output('card-recovered', 'children'),
              [Input('my-dropdown', 'value')])
+@coalesce
 def update_children(X):
-    return html.H3(str(f'{requests.get("https://corona.lmao.ninja/countries/"+str(X)).json()["recovered"] :,}'), className="card-title")
+    return live_kpi(X, "recovered", store)
 
 @app.callback(Output('card-deceased', 'children'),
              [Input('my-dropdown', 'value')])
+@coalesce
 def update_children(X):
-    return html.H3(str(f'{requests.get("https://corona.lmao.ninja/countries/"+str(X)).json()["deaths"] :,}'), className="card-title")
+    return live_kpi(X, "deaths", store)
+
+# Callbacks Date Range - World Curves
+@app.callback(Output('graph-confirmed-world', 'figure'),
+             [Input('date-range-world', 'value')])
+@coalesce
+def update_figure(date_range):
+    data = store
+    window = slider_window(data["dates"], date_range)
+    fig = {
+                                'data': [
+                                    dict(
+                                        x=data["labels"][window],
+                                        y=data["world_cases"][window],
+                                        mode='lines+markers',
+                                        opacity=0.7,
+                                        marker={
+                                            'size': 7,
+                                            'line': {'width': 1}
+                                        },
+                                        line={
+                                            'width': 5
+                                        },
+                                        name="World"
+                                    )
+                                ],
+                                'layout': dict(
+                                    xaxis={'type': 'lin'},
+                                    yaxis={'type': 'lin', 'title': 'Total Confirmed Cases'},
+                                    margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
+                                    legend={'x': 1, 'y': 1},
+                                    hovermode='closest',
+                                    title = 'Total Confirmed Cases'
+                                    # title="Trend of total confirmed cases"
+                                )
+                            }
+    return fig
+
+@app.callback(Output('graph-daily-world', 'figure'),
+             [Input('date-range-world', 'value')])
+@coalesce
+def update_figure(date_range):
+    data = store
+    window = slider_window(data["dates"], date_range)
+    fig = {
+                            'data': [
+                                dict(
+                                    x=data["labels"][window],
+                                    y=data["world_new_cases"][window],
+                                    type='bar',
+                                    opacity=0.7,
+                                    marker={
+                                        'size': 7,
+                                        'line': {'width': 1},
+                                    },
+                                    name="World"
+                                )
+                            ],
+                            'layout': dict(
+                                xaxis={},
+                                yaxis={'title': 'Daily New Cases'},
+                                margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
+                                legend={'x': 1, 'y': 1},
+                                hovermode='closest',
+                                title = 'Daily New Confirmed Cases'
+                                # title="Trend of total confirmed cases"
+                            )
+                        }
+    return fig
+
+@app.callback(Output('graph-deceased-world', 'figure'),
+             [Input('date-range-world', 'value')])
+@coalesce
+def update_figure(date_range):
+    data = store
+    window = slider_window(data["dates"], date_range)
+    fig = {
+                            'data': [
+                                dict(
+                                    x=data["labels"][window],
+                                    y=data["world_deaths"][window],
+                                    mode='lines+markers',
+                                    opacity=0.7,
+                                    marker={
+                                        'size': 7,
+                                        'line': {'width': 1},
+                                        'color':'orange'
+                                    },
+                                    line={
+                                        'width': 5,
+                                        'color':'orange'
+                                    },
+                                    name="World"
+                                )
+                            ],
+                            'layout': dict(
+                                xaxis={},
+                                yaxis={'type': 'lin', 'title': 'Total Deceased'},
+                                margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
+                                legend={'x': 1, 'y': 1},
+                                hovermode='closest',
+                                title = 'Total Deceased'
+                                # title="Trend of total confirmed cases"
+                            )
+                        }
+    return fig
+
+@app.callback(Output('graph-daily-deceased-world', 'figure'),
+             [Input('date-range-world', 'value')])
+@coalesce
+def update_figure(date_range):
+    data = store
+    window = slider_window(data["dates"], date_range)
+    fig = {
+                            'data': [
+                                dict(
+                                    x=data["labels"][window],
+                                    y=data["world_new_deaths"][window],
+                                    type='bar',
+                                    opacity=0.7,
+                                    marker={
+                                        'size': 7,
+                                        'line': {'width': 1},
+                                        'color':'orange'
+                                    },
+                                    name="World"
+                                )
+                            ],
+                            'layout': dict(
+                                xaxis={},
+                                yaxis={'title': 'Daily New Deceased'},
+                                margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
+                                legend={'x': 1, 'y': 1},
+                                hovermode='closest',
+                                title = 'Daily New Deceased'
+                                # title="Trend of total confirmed cases"
+                            )
+                        }
+    return fig
 
 # Callbacks Dropdown - Curves
 @app.callback(Output('graph-confirmed', 'figure'),
-             [Input('my-dropdown', 'value')])
-def update_figure(X):
+             [Input('my-dropdown', 'value'),
+              Input('date-range-country', 'value')])
+@coalesce
+def update_figure(X, date_range):
+    data = store
+    row = resolve_country(X, data)
+    if row is None:
+        raise PreventUpdate
+    window = slider_window(data["dates"], date_range)
     fig = {
                                 'data': [
                                     dict(
-                                        x=df_cases.columns[1:],
-                                        y=df_cases[df_cases['Country'] == i].sum()[1:],
+                                        x=data["labels"][window],
+                                        y=data["cases"][row, window],
                                         mode='lines+markers',
                                         opacity=0.7,
                                         marker={
@@ -366,13 +813,20 @@ def update_figure(X):
     return fig
 
 @app.callback(Output('graph-deceased', 'figure'),
-             [Input('my-dropdown', 'value')])
-def update_figure(X):
+             [Input('my-dropdown', 'value'),
+              Input('date-range-country', 'value')])
+@coalesce
+def update_figure(X, date_range):
+    data = store
+    row = resolve_country(X, data)
+    if row is None:
+        raise PreventUpdate
+    window = slider_window(data["dates"], date_range)
     fig = {
                                 'data': [
                                     dict(
-                                        x=df_deaths.columns[1:],
-                                        y=df_deaths[df_deaths['Country'] == i].sum()[1:],
+                                        x=data["labels"][window],
+                                        y=data["deaths"][row, window],
                                         mode='lines+markers',
                                         opacity=0.7,
                                         marker={
@@ -400,13 +854,20 @@ def update_figure(X):
     return fig
 
 @app.callback(Output('graph-daily', 'figure'),
-             [Input('my-dropdown', 'value')])
-def update_figure(X):
+             [Input('my-dropdown', 'value'),
+              Input('date-range-country', 'value')])
+@coalesce
+def update_figure(X, date_range):
+    data = store
+    row = resolve_country(X, data)
+    if row is None:
+        raise PreventUpdate
+    window = slider_window(data["dates"], date_range)
     fig={
                             'data': [
                                 dict(
-                                    x=df_cases.columns[1:],
-                                    y=df_cases[df_cases['Country'] == i].sum()[1:].diff(),
+                                    x=data["labels"][window],
+                                    y=data["new_cases"][row, window],
                                     type='bar',
                                     opacity=0.7,
                                     marker={
@@ -429,13 +890,20 @@ def update_figure(X):
     return fig
 
 @app.callback(Output('graph-daily-deceased', 'figure'),
-             [Input('my-dropdown', 'value')])
-def update_figure(X):
+             [Input('my-dropdown', 'value'),
+              Input('date-range-country', 'value')])
+@coalesce
+def update_figure(X, date_range):
+    data = store
+    row = resolve_country(X, data)
+    if row is None:
+        raise PreventUpdate
+    window = slider_window(data["dates"], date_range)
     fig={
                             'data': [
                                 dict(
-                                    x=df_deaths.columns[1:],
-                                    y=df_deaths[df_deaths['Country'] == i].sum()[1:].diff(),
+                                    x=data["labels"][window],
+                                    y=data["new_deaths"][row, window],
                                     type='bar',
                                     opacity=0.7,
                                     marker={
@@ -458,10 +926,109 @@ def update_figure(X):
                         }
     return fig
 
+# Callbacks Maps: the server only delivers chunks, drawing and playing happens in the browser (assets/maps.js)
+@app.callback(Output('map-chunk', 'data'),
+              [Input('map-chunk-start', 'data')])
+@coalesce
+def load_map_chunk(start):
+    data = store
+    if start is None:
+        raise PreventUpdate
+    return map_chunk(map_chunk_start(int(start), data), data)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='maps', function_name='render'),
+    [Output('map-world', 'figure'),
+     Output('map-europe', 'figure'),
+     Output('map-asia', 'figure')],
+    [Input('map-day', 'value'),
+     Input('map-chunk', 'data')],
+    [State('map-base', 'data')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace='maps', function_name='chunkStart'),
+    Output('map-chunk-start', 'data'),
+    [Input('map-day', 'value')],
+    [State('map-chunk', 'data'),
+     State('map-base', 'data')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace='maps', function_name='togglePlay'),
+    [Output('map-timer', 'disabled'),
+     Output('map-play', 'children')],
+    [Input('map-play', 'n_clicks')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace='maps', function_name='step'),
+    Output('map-day', 'value'),
+    [Input('map-timer', 'n_intervals')],
+    [State('map-day', 'value'),
+     State('map-day', 'max')])
+
+# Callback Leaderboard: paging, sorting and filtering happen on the server, the browser only receives the current page
+filter_operators = [["ge ", ">="], ["le ", "<="], ["lt ", "<"], ["gt ", ">"], ["ne ", "!="], ["eq ", "="], ["contains "]]
+
+def split_filter_part(filter_part):
+    for operator_type in filter_operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+                value_part = value_part.strip()
+                if value_part and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', "`"):
+                    value = value_part[1: -1].replace("\\" + value_part[0], value_part[0])
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+@app.callback([Output('leaderboard', 'data'),
+               Output('leaderboard', 'page_count')],
+              [Input('leaderboard', 'page_current'),
+               Input('leaderboard', 'page_size'),
+               Input('leaderboard', 'sort_by'),
+               Input('leaderboard', 'filter_query')])
+@coalesce
+def update_leaderboard(page_current, page_size, sort_by, filter_query):
+    rankings = store["rankings"]
+    mask = pd.Series(True, index=rankings.index)
+    for filter_part in (filter_query or "").split(" && "):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name == "Country":
+            column = rankings.index.to_series()
+        elif col_name in rankings.columns:
+            column = rankings[col_name]
+        else:
+            continue
+        if operator == "contains":
+            mask &= column.astype(str).str.contains(str(value), case=False, regex=False)
+        elif col_name == "Country" and operator in ("eq", "ne"): # Names only support (in)equality, not ordering
+            mask &= getattr(column, operator)(str(value))
+        elif col_name != "Country" and operator in ("eq", "ne", "lt", "le", "gt", "ge") and isinstance(value, float):
+            mask &= getattr(column, operator)(value)
+    among = rankings.index[mask]
+
+    end = (page_current + 1) * page_size
+    sort = sort_by[0] if sort_by else {}
+    if sort.get("column_id") not in ("Country", *rankings.columns): # Column ids come from the client
+        sort = {"column_id": "cases", "direction": "desc"}
+    ascending = sort["direction"] == "asc"
+    if sort["column_id"] == "Country":
+        order = among.sort_values(ascending=ascending)[:end].tolist()
+    else:
+        order = rank_countries(rankings, sort["column_id"], end, ascending=ascending, among=among)
+    page = rankings.loc[order[page_current * page_size:end]]
+    return page.reset_index().to_dict("records"), max(1, -(-len(among) // page_size))
+
 # Callback tabs
 @app.callback(Output('tabs-content-classes', 'children'),
               [Input('tabs-with-classes', 'value')])
+@coalesce
 def render_content(tab):
+    data = store
     if tab == 'tab-1':
         return html.Div([
                 html.Div([
@@ -470,7 +1037,7 @@ def render_content(tab):
                                     [
                                         dbc.CardHeader("Total Cases:"),
                                         dbc.CardBody(
-                                            [html.H3(str(f'{live_all["cases"] :,}'), className="card-title")]
+                                            kpi_card_body(data["live_all"].get("cases"), data["live_all_stale"])
                                         ),
                                     ],
                                     style={"width": "30rem"},
@@ -481,9 +1048,7 @@ def render_content(tab):
                                     [
                                         dbc.CardHeader("Active Cases:"),
                                         dbc.CardBody(
-                                            [
-                                                html.H3(str(f'{live_all["active"] :,}'), className="card-title")
-                                            ]
+                                            kpi_card_body(data["live_all"].get("active"), data["live_all_stale"])
                                         ),
                                     ],
                                     style={"width": "30rem"},
@@ -494,9 +1059,7 @@ def render_content(tab):
                                     [
                                         dbc.CardHeader("Total Recovered:"),
                                         dbc.CardBody(
-                                            [
-                                                html.H3(str(f'{live_all["recovered"] :,}'), className="card-title")
-                                            ]
+                                            kpi_card_body(data["live_all"].get("recovered"), data["live_all_stale"])
                                         ),
                                     ],
                                     style={"width": "30rem"},
@@ -507,139 +1070,36 @@ def render_content(tab):
                                     [
                                         dbc.CardHeader("Total Deceased:"),
                                         dbc.CardBody(
-                                            [
-                                                html.H3(str(f'{live_all["deaths"] :,}'), className="card-title")
-                                            ]
+                                            kpi_card_body(data["live_all"].get("deaths"), data["live_all_stale"])
                                         ),
                                     ],
                                     style={"width": "30rem"},
                                 )
                         ], className="three columns"),
                     ], className="row"),
+                    html.Div([
+                        html.Label("Select a date range:"),
+                        date_range_slider('date-range-world', data),
+                    ], className="row"),
                     html.Div([
                         html.Div([
                         dcc.Graph(
                             id='graph-confirmed-world',
-                            figure={
-                                'data': [
-                                    dict(
-                                        x=df_cases.columns[1:],
-                                        y=df_cases.sum()[1:],
-                                        mode='lines+markers',
-                                        opacity=0.7,
-                                        marker={
-                                            'size': 7,
-                                            'line': {'width': 1}
-                                        },
-                                        line={
-                                            'width': 5
-                                        },
-                                        name="World"
-                                    )
-                                ],
-                                'layout': dict(
-                                    xaxis={'type': 'lin'},
-                                    yaxis={'type': 'lin', 'title': 'Total Confirmed Cases'},
-                                    margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
-                                    legend={'x': 1, 'y': 1},
-                                    hovermode='closest',
-                                    title = 'Total Confirmed Cases'
-                                    # title="Trend of total confirmed cases"
-                                )
-                            }
                         )
                         ], className="row"),
                     html.Div([
                     dcc.Graph(
                         id='graph-daily-world',
-                        figure={
-                            'data': [
-                                dict(
-                                    x=df_cases.columns[1:],
-                                    y=df_cases.sum()[1:].diff(),
-                                    type='bar',
-                                    opacity=0.7,
-                                    marker={
-                                        'size': 7,
-                                        'line': {'width': 1},
-                                    },
-                                    name="World"
-                                )
-                            ],
-                            'layout': dict(
-                                xaxis={},
-                                yaxis={'title': 'Daily New Cases'},
-                                margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
-                                legend={'x': 1, 'y': 1},
-                                hovermode='closest',
-                                title = 'Daily New Confirmed Cases'
-                                # title="Trend of total confirmed cases"
-                            )
-                        }
                     )
                     ], className="row"),
                     html.Div([
                     dcc.Graph(
                         id='graph-deceased-world',
-                        figure={
-                            'data': [
-                                dict(
-                                    x=df_deaths.columns[1:],
-                                    y=df_deaths.sum()[1:],
-                                    mode='lines+markers',
-                                    opacity=0.7,
-                                    marker={
-                                        'size': 7,
-                                        'line': {'width': 1},
-                                        'color':'orange'
-                                    },
-                                    line={
-                                        'width': 5,
-                                        'color':'orange'
-                                    },
-                                    name="World"
-                                )
-                            ],
-                            'layout': dict(
-                                xaxis={},
-                                yaxis={'type': 'lin', 'title': 'Total Deceased'},
-                                margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
-                                legend={'x': 1, 'y': 1},
-                                hovermode='closest',
-                                title = 'Total Deceased'
-                                # title="Trend of total confirmed cases"
-                            )
-                        }
                     )
                     ], className="row"),
                     html.Div([
                     dcc.Graph(
                         id='graph-daily-deceased-world',
-                        figure={
-                            'data': [
-                                dict(
-                                    x=df_deaths.columns[1:],
-                                    y=df_deaths.sum()[1:].diff(),
-                                    type='bar',
-                                    opacity=0.7,
-                                    marker={
-                                        'size': 7,
-                                        'line': {'width': 1},
-                                        'color':'orange'
-                                    },
-                                    name="World"
-                                )
-                            ],
-                            'layout': dict(
-                                xaxis={},
-                                yaxis={'title': 'Daily New Deceased'},
-                                margin={'l': 50, 'b': 100, 't': 50, 'r': 50},
-                                legend={'x': 1, 'y': 1},
-                                hovermode='closest',
-                                title = 'Daily New Deceased'
-                                # title="Trend of total confirmed cases"
-                            )
-                        }
                     )
                     ], className="row"),
                     ])
@@ -651,7 +1111,7 @@ def render_content(tab):
                         html.Label("Select a country:"),
                         dcc.Dropdown(
                             id="my-dropdown",
-                            options=dropdown_options,
+                            options=data["dropdown_options"],
                             value="Germany",
                             placeholder="Select a country",
                         ),
@@ -661,9 +1121,7 @@ def render_content(tab):
                                 [
                                     dbc.CardHeader("Total Cases:"),
                                     dbc.CardBody(id="card-cases", children=
-                                        [
-                                            html.H3(str(f'{requests.get("https://corona.lmao.ninja/countries/"+"Germany").json()["cases"] :,}'), className="card-title")
-                                        ]
+                                        live_kpi("Germany", "cases", data)
                                     )
                                 ],
                                 style={"width": "10rem"},
@@ -674,9 +1132,7 @@ def render_content(tab):
                                 [
                                     dbc.CardHeader("Total Recovered:"),
                                     dbc.CardBody(id="card-recovered", children=
-                                        [
-                                            html.H3(str(f'{requests.get("https://corona.lmao.ninja/countries/Germany").json()["recovered"] :,}'), className="card-title")
-                                        ]
+                                        live_kpi("Germany", "recovered", data)
                                     ),
                                 ],
                                 style={"width": "30rem"},
@@ -687,15 +1143,17 @@ def render_content(tab):
                                 [
                                     dbc.CardHeader("Total Deceased:"),
                                     dbc.CardBody(id="card-deceased", children=
-                                        [
-                                            html.H3(str(f'{requests.get("https://corona.lmao.ninja/countries/Germany").json()["deaths"] :,}'), className="card-title")
-                                        ]
+                                        live_kpi("Germany", "deaths", data)
                                     ),
                                 ],
                                 style={"width": "30rem"},
                             )
                     ], className="three columns"),
                 ], className="row"),
+                html.Div([
+                    html.Label("Select a date range:"),
+                    date_range_slider('date-range-country', data),
+                ], className="row"),
                 html.Div([
                     html.Div([
                         dcc.Graph(id='graph-confirmed')
@@ -719,6 +1177,21 @@ def render_content(tab):
         ])
     elif tab == 'tab-3':
         return html.Div([
+                    html.Div([
+                        html.H4("Country Leaderboard"),
+                        dash_table.DataTable(
+                            id='leaderboard',
+                            columns=[{"name": "Country", "id": "Country"}] + [{"name": title, "id": metric, "type": "numeric"} for metric, title in ranking_metrics],
+                            page_current=0,
+                            page_size=15,
+                            page_action='custom',
+                            sort_action='custom',
+                            sort_mode='single',
+                            sort_by=[{"column_id": "cases", "direction": "desc"}],
+                            filter_action='custom',
+                            filter_query='',
+                        )
+                    ], className="row"),
                     dcc.Markdown('To show only one country, double-click on the country in the legend. Single-click on other countries in the legend to add them to the selection. Double-click again to reset the selection.'),
                     html.Div([
                         dcc.Graph(
@@ -726,7 +1199,7 @@ def render_content(tab):
                             figure={
                                 'data': [
                                     dict(
-                                        y=df_cases[df_cases['Country'] == i].sum()[1:][df_cases[df_cases['Country'] == i].sum()[1:].gt(threshold)],
+                                        y=data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:][data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:].gt(threshold)],
                                         mode='lines',
                                         opacity=0.7,
                                         marker={
@@ -734,7 +1207,7 @@ def render_content(tab):
                                             'line': {'width': 1},
                                         },
                                         name=i
-                                    ) for i in df_cases["Country"].unique()
+                                    ) for i in data["df_cases"]["Country"].unique()
                                 ],
                                 'layout': dict(
                                     xaxis={'range':[0,120],'type': 'lin', 'title':'''Number of days since >100 cases'''},
@@ -753,7 +1226,7 @@ def render_content(tab):
                             figure={
                                 'data': [
                                     dict(
-                                        y=df_cases[df_cases['Country'] == i].sum()[1:][df_cases[df_cases['Country'] == i].sum()[1:].gt(threshold)],
+                                        y=data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:][data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:].gt(threshold)],
                                         mode='lines+markers',
                                         opacity=0.7,
                                         marker={
@@ -761,7 +1234,7 @@ def render_content(tab):
                                             'line': {'width': 1}
                                         },
                                         name=i
-                                    ) for i in countries_europe
+                                    ) for i in rank_countries(data["rankings"], "cases", 10, among=region_europe)
                                 ],
                                 'layout': dict(
                                     xaxis={'range':[0,120],'type': 'lin', 'title':'''Number of days since >100 cases'''},
@@ -779,7 +1252,7 @@ def render_content(tab):
                             figure={
                                 'data': [
                                     dict(
-                                        y=df_cases[df_cases['Country'] == i].sum()[1:][df_cases[df_cases['Country'] == i].sum()[1:].gt(threshold)],
+                                        y=data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:][data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:].gt(threshold)],
                                         mode='lines+markers',
                                         opacity=0.7,
                                         marker={
@@ -787,7 +1260,7 @@ def render_content(tab):
                                             'line': {'width': 1}
                                         },
                                         name=i
-                                    ) for i in countries_asia
+                                    ) for i in rank_countries(data["rankings"], "cases", 10, among=region_asia)
                                 ],
                                 'layout': dict(
                                     xaxis={'range':[0,120],'type': 'lin', 'title':'''Number of days since >100 cases'''},
@@ -811,7 +1284,7 @@ def render_content(tab):
         #             figure={
         #                 'data': [
         #                     dict(
-        #                         y=df_cases[df_cases['Country'] == i].sum()[1:][df_cases[df_cases['Country'] == i].sum()[1:].gt(threshold)],
+        #                         y=data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:][data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:].gt(threshold)],
         #                         mode='lines+markers',
         #                         opacity=0.7,
         #                         marker={
@@ -837,7 +1310,7 @@ def render_content(tab):
         #             figure={
         #                 'data': [
         #                     dict(
-        #                         y=df_cases[df_cases['Country'] == i].sum()[1:][df_cases[df_cases['Country'] == i].sum()[1:].gt(threshold)],
+        #                         y=data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:][data["df_cases"][data["df_cases"]['Country'] == i].sum()[1:].gt(threshold)],
         #                         mode='lines+markers',
         #                         opacity=0.7,
         #                         marker={
@@ -863,13 +1336,37 @@ def render_content(tab):
         return html.Div([
         #dcc.Markdown('''Visualization of available data on maps (World, Europe, Germany, ...) to display regional clusters and the spread of the pandemic.'''),
         html.Div([
-            dcc.Graph(id='map-world', figure=fig_world),
+            html.Label("Select a day or press Play to watch the spread over time:"),
+            html.Div([
+                html.Button("Play", id='map-play'),
+            ], className='one columns'),
+            html.Div([
+                dcc.Slider(
+                    id='map-day',
+                    min=0,
+                    max=len(data["labels"]) - 1,
+                    step=1,
+                    value=len(data["labels"]) - 1,
+                    marks={day: date.strftime("%b %d") for day, date in enumerate(data["dates"]) if date.day == 1},
+                ),
+            ], className='eleven columns'),
+            dcc.Interval(id='map-timer', interval=map_frame_ms, disabled=True),
+            dcc.Store(id='map-base', data={
+                "titles": [title for title, scope in map_scopes],
+                "figures": [map_base_figure(scope) for title, scope in map_scopes],
+                "last": len(data["labels"]) - 1,
+            }),
+            dcc.Store(id='map-chunk-start'),
+            dcc.Store(id='map-chunk', data=map_chunk(map_chunk_start(len(data["labels"]) - 1, data), data)),
         ], className='row'),
         html.Div([
-            dcc.Graph(id='map-europe', figure=fig_europe),
+            dcc.Graph(id='map-world'),
         ], className='row'),
         html.Div([
-            dcc.Graph(id='map-asia', figure=fig_asia),
+            dcc.Graph(id='map-europe'),
+        ], className='row'),
+        html.Div([
+            dcc.Graph(id='map-asia'),
         ], className='row'),
     ])
 
@@ -886,6 +1383,202 @@ def render_content(tab):
         ])
 
 
+### Response Cache
+# Layout and dependencies never change while the app runs, the heavy tab contents only change with the data. Their
+# responses are compressed once and then served from memory in the encoding the client accepts (Flask-Compress skips
+# them, since they already carry a Content-Encoding). Only the tabs showing live values follow the live refreshes,
+# the others are keyed on the JHU data alone.
+cached_outputs = {"tabs-content-classes.children"} # Callback outputs worth caching
+live_tabs = {"tab-1", "tab-2"} # Tabs with live KPI cards
+brotli_quality = 5 # Default 11 is far too slow on the request path for multi-MB tabs
+response_cache = collections.OrderedDict()
+response_cache_size = 64 # Number of cached responses, least recently used ones are dropped first
+response_cache_lock = threading.Lock()
+
+def response_cache_key():
+    path = flask.request.path
+    if path.endswith("/_dash-layout") or path.endswith("/_dash-dependencies"):
+        return (path, "", None)
+    if path.endswith("/_dash-update-component") and flask.request.method == "POST":
+        body = flask.request.get_json(silent=True) or {}
+        if body.get("output") in cached_outputs:
+            tab = ((body.get("inputs") or [{}])[0] or {}).get("value")
+            data = store
+            version = data["version"] if tab in live_tabs else data["jhu_version"]
+            return (path, json.dumps([body["output"], body.get("inputs"), body.get("state")], sort_keys=True), version)
+    return None
+
+def cached_response(entry):
+    accept = flask.request.accept_encodings
+    if entry["br"] is not None and accept["br"]:
+        encoding = "br"
+    elif accept["gzip"]:
+        encoding = "gzip"
+    else:
+        encoding = "identity"
+    etag = entry["etag"] + ("" if encoding == "identity" else "-" + encoding)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(entry[encoding], mimetype=entry["mimetype"])
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+@server.before_request
+def serve_cached_response():
+    key = response_cache_key()
+    with response_cache_lock:
+        entry = response_cache.get(key) if key is not None else None
+        if entry is not None:
+            response_cache.move_to_end(key)
+    flask.g.response_cache_key = key if entry is None else None # Only store responses that were computed
+    return cached_response(entry) if entry is not None else None
+
+@server.after_request
+def store_cached_response(response):
+    key = flask.g.get("response_cache_key")
+    if key is None or response.status_code != 200 or response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    body = response.get_data()
+    entry = {
+        "etag": hashlib.sha1(body).hexdigest()[:16],
+        "mimetype": response.mimetype,
+        "identity": body,
+        "gzip": gzip.compress(body, 6),
+        "br": brotli.compress(body, quality=brotli_quality) if brotli is not None else None,
+    }
+    with response_cache_lock:
+        response_cache[key] = entry
+        while len(response_cache) > response_cache_size:
+            response_cache.popitem(last=False)
+    return cached_response(entry)
+
+### Export API
+# /api/series?country=Germany,Italy&metric=cases,new_deaths&from=2020-03-01&to=2020-04-30&format=csv|json|arrow
+# Countries can be given by JHU name, NovelCOVID name or ISO code, omitting country exports all countries. Responses are generated in chunks of countries and gzip-compressed on the fly.
+api_metrics = ["cases", "new_cases", "deaths", "new_deaths", "recovered", "new_recovered"]
+api_mimetypes = {"csv": "text/csv", "json": "application/json", "arrow": "application/vnd.apache.arrow.stream"}
+api_chunk_rows = 10000 # Approximate number of rows serialized per chunk
+api_max_countries = 500 # Longest accepted country list, well above the number of countries
+
+def api_error(message, status=400):
+    return flask.jsonify(error=message), status
+
+# Collects the bytes pyarrow writes so they can be yielded chunk by chunk
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def api_blocks(ids, metrics, window, data):
+    labels = data["labels"][window]
+    chunk_size = max(1, api_chunk_rows // max(1, len(labels)))
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        block = pd.DataFrame({
+            "country": pd.Index([data["countries"][cid] for cid in chunk]).repeat(len(labels)),
+            "date": np.tile(labels, len(chunk)),
+        })
+        for metric in metrics:
+            block[metric] = pd.array(data[metric][chunk, window].ravel(), dtype="Int64") # Counts, missing values stay empty
+        yield block
+
+def api_encode(blocks, fmt):
+    if fmt == "csv":
+        header = True
+        for block in blocks:
+            yield block.to_csv(header=header, index=False, float_format="%.0f").encode()
+            header = False
+    elif fmt == "json":
+        separator = b"["
+        for block in blocks:
+            if len(block):
+                yield separator + block.to_json(orient="records")[1:-1].encode()
+                separator = b","
+        yield b"]" if separator == b"," else b"[]"
+    else:
+        sink = ChunkSink()
+        writer = None
+        for block in blocks:
+            batch = pa.RecordBatch.from_pandas(block, preserve_index=False)
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, batch.schema)
+            writer.write_batch(batch)
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+            yield sink.drain()
+
+def api_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@server.route("/api/series")
+def api_series():
+    args = flask.request.args
+    # Capture the current data so a refresh cannot change it while the response is streamed
+    data = store
+    version = data["version"]
+
+    fmt = args.get("format", "csv").lower()
+    if fmt not in api_mimetypes:
+        return api_error("Unknown format '{}', use one of: {}".format(fmt, ", ".join(api_mimetypes)))
+    if fmt == "arrow" and pa is None:
+        return api_error("Arrow export requires pyarrow on the server", 501)
+
+    metrics = [m for value in args.getlist("metric") for m in value.split(",") if m] or ["cases"]
+    unknown = [m for m in metrics if m not in api_metrics]
+    if unknown:
+        return api_error("Unknown metric(s): {}. Available: {}".format(", ".join(unknown), ", ".join(api_metrics)))
+
+    if sum(value.count(",") + 1 for value in args.getlist("country")) > api_max_countries:
+        return api_error("Too many countries, at most {} per request".format(api_max_countries))
+    countries = []
+    for value in args.getlist("country"): # Repeated parameters or comma-separated lists
+        countries += split_countries(value, data)
+    ids = [resolve_country(c, data) for c in countries] if countries else list(range(len(data["countries"])))
+    unknown = [c for c, cid in zip(countries, ids) if cid is None]
+    if unknown:
+        return api_error("Unknown country: {}".format(", ".join(unknown)), 404)
+
+    try:
+        window = date_window(data["dates"], args.get("from") or None, args.get("to") or None)
+    except ValueError:
+        return api_error("Invalid date in 'from' or 'to', use YYYY-MM-DD")
+
+    use_gzip = flask.request.accept_encodings["gzip"] > 0 # Honours q=0, unlike a substring test
+    query = "&".join("{}={}".format(k, v) for k, v in sorted(args.items(multi=True)))
+    etag = "{}-{}{}".format(version, hashlib.sha1(query.encode()).hexdigest()[:12], "-gz" if use_gzip else "")
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        chunks = api_encode(api_blocks(ids, metrics, window, data), fmt)
+        response = flask.Response(flask.stream_with_context(api_gzip(chunks) if use_gzip else chunks), mimetype=api_mimetypes[fmt])
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip" # Also keeps Flask-Compress from buffering the stream
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
 ### Run App
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,46 @@
+// Clientside callbacks of the Maps tab, see "Create Map figure" in app.py
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    maps: {
+        // Draws the selected day from the loaded chunk, waits for the next chunk if the day is not in it
+        render: function(day, chunk, base) {
+            var no_update = window.dash_clientside.no_update;
+            if (!chunk || !base || day < chunk.start || day >= chunk.start + chunk.labels.length) {
+                return [no_update, no_update, no_update];
+            }
+            var i = day - chunk.start;
+            return base.figures.map(function(figure, f) {
+                return {
+                    data: figure.data.map(function(trace, t) {
+                        return Object.assign({}, trace, {
+                            locations: chunk.locations,
+                            text: chunk.text[t][i],
+                            marker: Object.assign({}, trace.marker, {size: chunk.sizes[t][i]})
+                        });
+                    }),
+                    layout: Object.assign({}, figure.layout, {title: base.titles[f] + " - " + chunk.labels[i]})
+                };
+            });
+        },
+
+        // Requests a new chunk from the server once the selected day leaves the loaded one
+        chunkStart: function(day, chunk, base) {
+            if (day === undefined || day === null || (chunk && day >= chunk.start && day < chunk.start + chunk.labels.length)) {
+                return window.dash_clientside.no_update;
+            }
+            return day;
+        },
+
+        togglePlay: function(n_clicks) {
+            var playing = (n_clicks || 0) % 2 === 1;
+            return [!playing, playing ? "Pause" : "Play"];
+        },
+
+        // One day per timer tick, starting over at the end
+        step: function(n_intervals, day, max) {
+            if (!n_intervals) {
+                return window.dash_clientside.no_update;
+            }
+            return day >= max ? 0 : day + 1;
+        }
+    }
+});
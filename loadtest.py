@@ -0,0 +1,369 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote
+
+### Load Test Harness
+# Starts local stand-ins for the JHU CSV files and the NovelCOVID API, runs the app under gunicorn against them and
+# simulates users clicking through the dashboard via the Dash callback endpoints. Reports throughput, latency
+# percentiles per callback and memory per gunicorn worker.
+#
+# Example: python loadtest.py --workers 2 --threads 4 --users 50 --duration 60 --api-latency 0.2 --failure-rate 0.05
+
+### Synthetic Data
+# (JHU name, NovelCOVID name, ISO2, ISO3, population), includes the names that differ between both sources
+known_countries = [
+    ("US", "USA", "US", "USA", 329466283),
+    ("Italy", "Italy", "IT", "ITA", 60461828),
+    ("Spain", "Spain", "ES", "ESP", 46754783),
+    ("Germany", "Germany", "DE", "DEU", 83783945),
+    ("France", "France", "FR", "FRA", 65273512),
+    ("United Kingdom", "UK", "GB", "GBR", 67886004),
+    ("China", "China", "CN", "CHN", 1404676330),
+    ("Iran", "Iran", "IR", "IRN", 83992953),
+    ("Turkey", "Turkey", "TR", "TUR", 84339067),
+    ("Switzerland", "Switzerland", "CH", "CHE", 8654618),
+    ("Belgium", "Belgium", "BE", "BEL", 11589616),
+    ("Netherlands", "Netherlands", "NL", "NLD", 17134873),
+    ("Austria", "Austria", "AT", "AUT", 9006400),
+    ("Korea, South", "S. Korea", "KR", "KOR", 51269183),
+    ("Japan", "Japan", "JP", "JPN", 126476458),
+    ("India", "India", "IN", "IND", 1380004385),
+    ("Taiwan*", "Taiwan", "TW", "TWN", 23816775),
+    ("Czechia", "Czech Republic", "CZ", "CZE", 10708982),
+    ("Burma", "Myanmar", "MM", "MMR", 54409794),
+    ("Brazil", "Brazil", "BR", "BRA", 212559409),
+]
+
+def synthetic_countries(count):
+    countries = list(known_countries[:count])
+    for number in range(len(countries), count):
+        iso3 = "X" + chr(ord("A") + number // 26 % 26) + chr(ord("A") + number % 26) # Unused ISO range, no ISO2 code
+        countries.append(("Country {:03d}".format(number), "Country {:03d}".format(number), "", iso3, random.randint(100000, 50000000)))
+    return countries
+
+# Cumulative series following a logistic curve per country
+def synthetic_series(countries, days, seed):
+    rng = random.Random(seed)
+    series = {}
+    for country in countries:
+        peak, midpoint, rate = rng.randint(100, 500000), rng.randint(20, days), rng.uniform(0.05, 0.3)
+        series[country[0]] = [int(peak / (1 + math.exp(-rate * (day - midpoint)))) for day in range(days)]
+    return series
+
+def build_stand_in_data(country_count, days):
+    countries = synthetic_countries(country_count)
+    start = datetime.date(2020, 1, 22)
+    dates = [start + datetime.timedelta(days=day) for day in range(days)]
+    labels = ["{}/{}/{}".format(date.month, date.day, date.strftime("%y")) for date in dates]
+    cases = synthetic_series(countries, days, 1)
+    ratios = {"recovered": 0.6, "deaths": 0.05}
+    files = {}
+    for name, key in (("confirmed", None), ("recovered", "recovered"), ("deaths", "deaths")):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["Province/State", "Country/Region", "Lat", "Long"] + labels)
+        for country in countries:
+            values = cases[country[0]] if key is None else [int(value * ratios[key]) for value in cases[country[0]]]
+            writer.writerow(["{} Province".format(country[0]), country[0], 0, 0] + values)
+        files["csse_covid_19_time_series/time_series_covid19_{}_global.csv".format(name)] = out.getvalue().encode()
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Country_Region", "Lat", "Long_", "Combined_Key", "Population"])
+    for uid, country in enumerate(countries):
+        writer.writerow([uid, country[2], country[3], uid, "", "", "", country[0], 0, 0, country[0], country[4]])
+    files["UID_ISO_FIPS_LookUp_Table.csv"] = out.getvalue().encode()
+
+    live_countries = [{
+        "country": country[1],
+        "countryInfo": {"iso2": country[2], "iso3": country[3]},
+        "cases": cases[country[0]][-1],
+        "active": int(cases[country[0]][-1] * 0.35),
+        "recovered": int(cases[country[0]][-1] * ratios["recovered"]),
+        "deaths": int(cases[country[0]][-1] * ratios["deaths"]),
+    } for country in countries]
+    live_all = {field: sum(entry[field] for entry in live_countries) for field in ("cases", "active", "recovered", "deaths")}
+    api = {"all": live_all, "countries": live_countries}
+    api.update({"countries/" + entry["country"]: entry for entry in live_countries})
+    return countries, dates, files, api
+
+### Stand-in Servers
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def stand_in_handler(files, api, options):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = unquote(self.path.split("?")[0])
+            if path.startswith("/jhu/"):
+                body, content_type, latency = files.get(path[len("/jhu/"):]), "text/csv", options.jhu_latency
+            elif path.startswith("/novelcovid/"):
+                entry = api.get(path[len("/novelcovid/"):])
+                body, content_type, latency = (json.dumps(entry).encode() if entry is not None else None), "application/json", options.api_latency
+            else:
+                body, content_type, latency = None, "text/plain", 0
+            # Latency with +-50% jitter, optional hangs (longer than any time budget) and server errors
+            time.sleep(latency * random.uniform(0.5, 1.5))
+            if random.random() < options.hang_rate:
+                time.sleep(60)
+            if random.random() < options.failure_rate:
+                self.send_error(500, "Injected failure")
+            elif body is None:
+                self.send_error(404)
+            else:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return StandInHandler
+
+def start_stand_ins(options, files, api):
+    httpd = ThreadingHTTPServer(("127.0.0.1", options.stand_in_port), stand_in_handler(files, api, options))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd, "http://127.0.0.1:{}".format(httpd.server_address[1])
+
+### App under gunicorn
+def start_app(options, stand_in_url):
+    env = dict(os.environ, JHU_URL=stand_in_url + "/jhu/", NOVELCOVID_URL=stand_in_url + "/novelcovid/")
+    command = [sys.executable, "-m", "gunicorn", "app:server",
+               "--bind", "127.0.0.1:{}".format(options.port),
+               "--workers", str(options.workers),
+               "--threads", str(options.threads),
+               "--timeout", str(options.timeout)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    app_url = "http://127.0.0.1:{}".format(options.port)
+    deadline = time.time() + options.boot_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with code {}".format(process.returncode))
+        try:
+            if requests.get(app_url + "/_dash-layout", timeout=1).ok:
+                return process, app_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("App did not come up within {} seconds".format(options.boot_timeout))
+
+# Resident memory of the gunicorn workers (children of the master process), read from /proc
+def worker_memory(master_pid):
+    memory = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(pid)) as stat:
+                parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+            if parent != master_pid:
+                continue
+            with open("/proc/{}/status".format(pid)) as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        memory[int(pid)] = int(line.split()[1]) / 1024 # MB
+        except (OSError, IndexError, ValueError):
+            continue
+    return memory
+
+### Simulated Users
+tabs = ["tab-1", "tab-2", "tab-3", "tab-4", "tab-5", "tab-6"]
+
+def callback_payload(output, inputs):
+    return {
+        "output": output,
+        "inputs": [{"id": id, "property": prop, "value": value} for id, prop, value in inputs],
+        "changedPropIds": ["{}.{}".format(id, prop) for id, prop, value in inputs[:1]],
+        "state": [],
+    }
+
+# Requests a user triggers with one interaction, as (callback name, payload)
+def user_actions(countries, dates):
+    first, last = dates[0].toordinal(), dates[-1].toordinal()
+
+    def switch_tab():
+        tab = random.choice(tabs)
+        return [("render_content:" + tab, callback_payload("tabs-content-classes.children", [("tabs-with-classes", "value", tab)]))]
+
+    def pick_country():
+        country = random.choice(countries)[0]
+        date_range = [random.choice([first, last - 30]), last]
+        actions = [("kpi", callback_payload(card + ".children", [("my-dropdown", "value", country)])) for card in ("card-cases", "card-recovered", "card-deceased")]
+        actions += [("country_graph", callback_payload(graph + ".figure", [("my-dropdown", "value", country), ("date-range-country", "value", date_range)]))
+                    for graph in ("graph-confirmed", "graph-daily", "graph-deceased", "graph-daily-deceased")]
+        return actions
+
+    def world_range():
+        date_range = [random.randint(first, last), last]
+        return [("world_graph", callback_payload(graph + ".figure", [("date-range-world", "value", date_range)]))
+                for graph in ("graph-confirmed-world", "graph-daily-world", "graph-deceased-world", "graph-daily-deceased-world")]
+
+    def leaderboard():
+        sort_by = [{"column_id": random.choice(["cases", "new_cases", "growth", "deaths_per_million"]), "direction": random.choice(["asc", "desc"])}]
+        inputs = [("leaderboard", "page_current", random.randint(0, 5)), ("leaderboard", "page_size", 15), ("leaderboard", "sort_by", sort_by), ("leaderboard", "filter_query", "")]
+        return [("leaderboard", callback_payload("..leaderboard.data...leaderboard.page_count..", inputs))]
+
+    def map_day():
+        day = random.randint(0, len(dates) - 1)
+        return [("maps", callback_payload("map-chunk.data", [("map-chunk-start", "data", day)]))]
+
+    # Relative frequency of each interaction
+    return [(switch_tab, 4), (pick_country, 4), (world_range, 2), (leaderboard, 1), (map_day, 1)]
+
+# Records (callback name, latency, HTTP status), status 0 if the request failed
+def post_callback(session, app_url, name, payload, results, lock):
+    started = time.time()
+    try:
+        status = session.post(app_url + "/_dash-update-component", json=payload, timeout=60).status_code
+    except requests.RequestException:
+        status = 0
+    with lock:
+        results.append((name, time.time() - started, status))
+
+# Sends the requests of one interaction concurrently, like the Dash renderer does, optionally spaced apart
+def post_callbacks(session, app_url, callbacks, results, lock, spacing=0):
+    threads = []
+    for name, payload in callbacks:
+        threads.append(threading.Thread(target=post_callback, args=(session, app_url, name, payload, results, lock)))
+        threads[-1].start()
+        time.sleep(spacing)
+    for thread in threads:
+        thread.join()
+
+def simulate_user(app_url, actions, stop_at, think_time, results, lock):
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip, br"
+    choices, weights = zip(*actions)
+    session.get(app_url + "/_dash-layout")
+    while time.time() < stop_at:
+        post_callbacks(session, app_url, random.choices(choices, weights)[0](), results, lock)
+        time.sleep(random.uniform(0, 2 * think_time))
+
+# A user scrolling through the dropdown: several overlapping requests of one session for the same output, of which
+# all but the last may be answered with "no update" (HTTP 204)
+def simulate_burst_user(app_url, countries, dates, stop_at, think_time, size, spacing, results, lock):
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip, br"
+    date_range = [dates[0].toordinal(), dates[-1].toordinal()]
+    session.get(app_url + "/_dash-layout")
+    while time.time() < stop_at:
+        burst = [("burst", callback_payload("graph-confirmed.figure", [("my-dropdown", "value", country[0]), ("date-range-country", "value", date_range)]))
+                 for country in random.sample(countries, size)]
+        post_callbacks(session, app_url, burst, results, lock, spacing)
+        time.sleep(random.uniform(0, 2 * think_time))
+
+### Smoke Test
+# Imports the app in this process against the stand-ins and sends every kind of request once through the Flask test
+# client. Catches data that breaks the app at import time, where gunicorn would only exit with code 3.
+def smoke_test(countries, dates, stand_in_url):
+    os.environ.update(JHU_URL=stand_in_url + "/jhu/", NOVELCOVID_URL=stand_in_url + "/novelcovid/")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    client = app.server.test_client()
+    checks = [("layout", client.get("/_dash-layout"))]
+    for tab in tabs:
+        checks.append(("render_content:" + tab, client.post("/_dash-update-component", json=callback_payload("tabs-content-classes.children", [("tabs-with-classes", "value", tab)]))))
+    for action, _ in user_actions(countries, dates):
+        checks += [(name, client.post("/_dash-update-component", json=payload)) for name, payload in action()]
+    checks.append(("api_series", client.get("/api/series", query_string={"country": countries[0][0], "metric": "cases,new_deaths"})))
+    failures = [(name, response.status_code) for name, response in checks if response.status_code not in (200, 204)]
+    for name, status in failures:
+        print("FAILED {}: HTTP {}".format(name, status))
+    print("Smoke test: {} requests, {} failed".format(len(checks), len(failures)))
+    return 1 if failures else 0
+
+### Report
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q / 100 * len(ordered))) - 1)] if ordered else float("nan")
+
+def report(results, duration, memory_samples):
+    print("\nRequests: {}  Errors: {}  Throughput: {:.1f} req/s".format(len(results), sum(status not in (200, 204) for _, _, status in results), len(results) / duration))
+    print("{:<28}{:>8}{:>8}{:>8}{:>10}{:>10}{:>10}".format("callback", "count", "errors", "204", "p50 ms", "p95 ms", "p99 ms"))
+    for name in sorted(set(name for name, _, _ in results)):
+        latencies = [latency * 1000 for n, latency, _ in results if n == name]
+        errors = sum(status not in (200, 204) for n, _, status in results if n == name)
+        no_updates = sum(status == 204 for n, _, status in results if n == name)
+        print("{:<28}{:>8}{:>8}{:>8}{:>10.0f}{:>10.0f}{:>10.0f}".format(name, len(latencies), errors, no_updates, percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99)))
+    print("\nMemory per worker (RSS MB): pid  mean  max")
+    for pid in sorted(set(pid for sample in memory_samples for pid in sample)):
+        values = [sample[pid] for sample in memory_samples if pid in sample]
+        print("  {:>8}{:>8.0f}{:>8.0f}".format(pid, sum(values) / len(values), max(values)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the dashboard against local stand-ins for JHU and NovelCOVID")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker (default as in the Procfile)")
+    parser.add_argument("--timeout", type=int, default=30, help="gunicorn worker timeout in seconds")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="test duration in seconds")
+    parser.add_argument("--burst-users", type=int, default=0, help="additional simulated users sending same-session bursts for one output")
+    parser.add_argument("--burst-size", type=int, default=5, help="requests per burst")
+    parser.add_argument("--burst-spacing", type=float, default=0.05, help="seconds between the requests of a burst")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean pause between interactions of a user in seconds")
+    parser.add_argument("--countries", type=int, default=190, help="number of countries in the stand-in data")
+    parser.add_argument("--days", type=int, default=120, help="number of days in the stand-in data")
+    parser.add_argument("--jhu-latency", type=float, default=0.5, help="mean latency of the JHU stand-in in seconds")
+    parser.add_argument("--api-latency", type=float, default=0.1, help="mean latency of the NovelCOVID stand-in in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of stand-in responses that fail with HTTP 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share of stand-in responses that hang for 60 seconds")
+    parser.add_argument("--port", type=int, default=8050, help="port of the app")
+    parser.add_argument("--stand-in-port", type=int, default=0, help="port of the stand-in servers (default: any free port)")
+    parser.add_argument("--boot-timeout", type=float, default=120, help="seconds to wait for the app to start")
+    parser.add_argument("--stand-ins-only", action="store_true", help="only run the stand-in servers, e.g. for local development")
+    parser.add_argument("--smoke", action="store_true", help="import the app against the stand-ins and send every kind of request once")
+    options = parser.parse_args()
+
+    countries, dates, files, api = build_stand_in_data(options.countries, options.days)
+    httpd, stand_in_url = start_stand_ins(options, files, api)
+    print("Stand-ins: JHU_URL={0}/jhu/ NOVELCOVID_URL={0}/novelcovid/".format(stand_in_url))
+    if options.stand_ins_only:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+    if options.smoke:
+        try:
+            sys.exit(smoke_test(countries, dates, stand_in_url))
+        finally:
+            httpd.shutdown()
+
+    process, app_url = start_app(options, stand_in_url)
+    try:
+        results, lock, memory_samples = [], threading.Lock(), []
+        actions = user_actions(countries, dates)
+        stop_at = time.time() + options.duration
+        users = [threading.Thread(target=simulate_user, args=(app_url, actions, stop_at, options.think_time, results, lock), daemon=True) for _ in range(options.users)]
+        users += [threading.Thread(target=simulate_burst_user, args=(app_url, countries, dates, stop_at, options.think_time, options.burst_size, options.burst_spacing, results, lock), daemon=True)
+                  for _ in range(options.burst_users)]
+        started = time.time()
+        for user in users:
+            user.start()
+        while any(user.is_alive() for user in users):
+            memory_samples.append(worker_memory(process.pid))
+            time.sleep(1)
+        report(results, time.time() - started, memory_samples)
+    finally:
+        process.terminate()
+        process.wait()
+        httpd.shutdown()
+
+if __name__ == '__main__':
+    main()